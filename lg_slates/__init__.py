@@ -3,15 +3,17 @@
 Usage: Put tools.lg_slates.on = True in the [global] section in your config file to enable this tool.
 
 tools.lg_slates.storage_type may be specified to change the storage medium (defaults to 'ram' for RamStorage)
+
+tools.lg_slates.mode may be set to 'readonly' or 'notouch' for specific paths to load the session without refreshing it (see Session.mode)
 """
 
-__all__ = [ 'Slate' ]
+__all__ = [ 'Slate', 'ReadOnlySlateError' ]
 __author__ = 'Walt Woods'
 
 import cherrypy
 from .common import *
 from .tool import SlateTool
-from .slates import Slate
+from .slates import Slate, ReadOnlySlateError
 
 cherrypy.tools.lg_slates = SlateTool()
 
@@ -0,0 +1,184 @@
+"""Time-decaying counting Bloom filter used as a per-process negative cache
+of slate names that are known to be expired or non-existant.
+
+Two generations of counters are kept.  Names are added to the current
+generation; once it has held capacity / 2 names or lifetime / 2 minutes
+have passed, it becomes the previous generation and the old previous
+generation is dropped.  A name is therefore remembered for between
+lifetime / 2 and lifetime minutes.
+
+Counters (rather than bits) allow a name to be discarded when a slate
+with that name is created, so that a live slate is never reported as
+expired because of an earlier negative lookup.  A lookup that races with
+the creation is covered too: callers read discard_mark before checking
+storage and pass it to add(), which drops the name if any discard
+happened in between.  The only remaining source
+of wrong answers is the filter's false-positive rate, which is bounded by
+error_rate as long as no more than capacity names are added per lifetime.
+"""
+
+import binascii
+import itertools
+import math
+from hashlib import sha1 as sha
+import threading
+import time
+
+class DecayingBloomFilter(object):
+    """A counting Bloom filter whose members expire after roughly lifetime
+    minutes.  Supports add(), discard() and the in operator.
+    """
+
+    lookups = 0
+    lookups__doc = "Number of membership tests performed"
+
+    hits = 0
+    hits__doc = "Number of membership tests that found the name"
+
+    adds = 0
+    adds__doc = "Number of names added"
+
+    invalidations = 0
+    invalidations__doc = "Number of names discarded because they were created"
+
+    discard_mark = 0
+    discard_mark__doc = "Changes on every discard(); read it before checking whether a name is expired, and pass it to add()"
+
+    def __init__(self, capacity, error_rate=1e-6, lifetime=5):
+        """capacity - Number of names to remember per lifetime.
+        error_rate - Upper bound on the false-positive rate.
+        lifetime - Minutes after which a name is forgotten.
+        """
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+
+        # Each lookup checks both generations, so size each of them for
+        # half of the capacity at half of the error rate.
+        per_gen = capacity // 2
+        gen_rate = error_rate / 2.0
+        ln2 = math.log(2)
+        self.size = int(math.ceil(-per_gen * math.log(gen_rate) / ln2 ** 2))
+        self.hash_count = max(1, int(round(self.size * ln2 / per_gen)))
+        self.capacity = capacity
+        self.lifetime = lifetime
+        self._per_gen = per_gen
+        self._lock = threading.Lock()
+        self._current = bytearray(self.size)
+        self._previous = bytearray(self.size)
+        self._count = 0
+        self._rotated = time.time()
+        self._marks = itertools.count(1)
+
+    def __contains__(self, name):
+        indexes = self._indexes(name)
+        with self._lock:
+            self._maybe_rotate()
+            self.lookups += 1
+            if self._has(self._current, indexes) \
+                    or self._has(self._previous, indexes):
+                self.hits += 1
+                return True
+        return False
+
+    def add(self, name, discard_mark=None):
+        """Remember name as expired.  If discard_mark is given, it should
+        be the value of self.discard_mark read before name was found to be
+        expired; if any name has been discarded since, name is not added,
+        as it may have been created in the meantime.
+        """
+        indexes = self._indexes(name)
+        with self._lock:
+            if discard_mark is not None and discard_mark != self.discard_mark:
+                return
+            self._maybe_rotate()
+            current = self._current
+            # Adding a name twice would require discarding it twice
+            if not self._has(current, indexes):
+                for i in indexes:
+                    if current[i] < 255:
+                        current[i] += 1
+                self._count += 1
+                self.adds += 1
+
+    def discard(self, name):
+        """Forget name, e.g. because a slate with that name was created.
+        After this call, name is guaranteed not to be in the filter.
+        """
+        indexes = self._indexes(name)
+        # Before the check below, so that a concurrent add() of name that
+        # the check misses sees the change.  Values are unique, so a
+        # racing discard can't restore the value an add() read.
+        self.discard_mark = next(self._marks)
+        if not self._has(self._current, indexes) \
+                and not self._has(self._previous, indexes):
+            # The common case (a name that was never added) needs no lock
+            return
+        with self._lock:
+            found = False
+            for gen in (self._current, self._previous):
+                # Looping handles names that were only present as a false
+                # positive or whose counters saturated; the extra
+                # decrements can only cause other names to be forgotten
+                # early, which is safe.
+                while self._has(gen, indexes):
+                    found = True
+                    for i in indexes:
+                        if gen[i]:
+                            gen[i] -= 1
+            if found:
+                self.invalidations += 1
+
+    def clear(self):
+        """Forget all names."""
+        with self._lock:
+            self._current = bytearray(self.size)
+            self._previous = bytearray(self.size)
+            self._count = 0
+            self._rotated = time.time()
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups that were answered from the filter."""
+        if not self.lookups:
+            return 0.0
+        return float(self.hits) / self.lookups
+
+    def stats(self):
+        """Returns a dict of the filter's counters."""
+        return {
+            'lookups': self.lookups
+            ,'hits': self.hits
+            ,'hit_rate': self.hit_rate
+            ,'adds': self.adds
+            ,'invalidations': self.invalidations
+            }
+
+    def _has(self, gen, indexes):
+        for i in indexes:
+            if not gen[i]:
+                return False
+        return True
+
+    def _indexes(self, name):
+        """Double hashing (Kirsch-Mitzenmacher) over one sha1 digest"""
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        digest = sha(name).digest()
+        h1 = int(binascii.hexlify(digest[:8]), 16)
+        h2 = int(binascii.hexlify(digest[8:16]), 16) | 1
+        size = self.size
+        return [ (h1 + i * h2) % size for i in range(self.hash_count) ]
+
+    def _should_rotate(self):
+        return self._count >= self._per_gen \
+            or self._rotated + self.lifetime * 30 < time.time()
+
+    def _maybe_rotate(self):
+        """Must be called with self._lock held"""
+        if self._should_rotate():
+            self._previous = self._current
+            self._current = bytearray(self.size)
+            self._count = 0
+            self._rotated = time.time()
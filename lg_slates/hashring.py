@@ -0,0 +1,45 @@
+"""Consistent hashing, used by ShardedSlate to map slate names to shards.
+
+Each node is placed on the ring at replicas pseudo-random points; a key
+belongs to the node owning the first point at or after the key's hash.
+Adding or removing a node therefore only moves the keys adjacent to its
+points, roughly 1 / len(nodes) of all keys.
+"""
+
+import binascii
+import bisect
+from hashlib import md5
+
+class ConsistentHashRing(object):
+    """Maps keys to nodes.  nodes is a dict of { node name: node }; the
+    names determine placement, so the same names always give the same ring.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        if not nodes:
+            raise ValueError("A ring needs at least one node")
+        self.nodes = dict(nodes)
+        self.replicas = replicas
+        points = []
+        for name in self.nodes:
+            for i in range(replicas):
+                points.append((self._hash('{0}#{1}'.format(name, i)), name))
+        points.sort()
+        self._hashes = [ h for h, _ in points ]
+        self._names = [ n for _, n in points ]
+
+    def get_name(self, key):
+        """Returns the name of the node that owns key"""
+        i = bisect.bisect_left(self._hashes, self._hash(key))
+        if i == len(self._hashes):
+            i = 0
+        return self._names[i]
+
+    def get(self, key):
+        """Returns the node that owns key"""
+        return self.nodes[self.get_name(key)]
+
+    def _hash(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return int(binascii.hexlify(md5(key).digest()[:8]), 16)
@@ -25,13 +25,28 @@ import cherrypy
 from cherrypy.lib import httputil
 
 from .common import *
+from .bloom import DecayingBloomFilter
+from .hashring import ConsistentHashRing
+from . import tracking
+
+try:
+    intern
+except NameError: #PY3
+    from sys import intern
 
 missing = object()
 
+class ReadOnlySlateError(RuntimeError):
+    """Raised on an attempt to write to a read-only slate, such as the
+    session on a path configured with tools.lg_slates.mode: 'readonly'.
+    """
+
 class Slate(object): #PY3 , metaclass=cherrypy._AttributeDocstrings):
     """A CherryPy dict-like Slate object (one per request for session state, as well as any number of named slates).
 
     Writing is accomplished only when set() is called, setdefault() is called, or an item is written (Slate['key'] = 'value').
+
+    With change tracking, dict and list values are returned as proxies that remember whether they were modified; flush() (called automatically at the end of each request) writes modified values back.
     """
     
     name = None
@@ -46,26 +61,72 @@ class Slate(object): #PY3 , metaclass=cherrypy._AttributeDocstrings):
     
     clean_freq = 60
     clean_freq__doc = "The poll rate for expired slate cleanup in minutes."
+
+    negative_cache = None
+    negative_cache__doc = "Per-process DecayingBloomFilter of slate names recently found to be expired, or None if disabled.  Its stats() method reports hit-rate counters."
+
+    negative_cache_size = 0
+    negative_cache_size__doc = "Number of expired slate names to remember per negative_cache_lifetime, or 0 to disable the negative cache."
+
+    negative_cache_error_rate = 1e-6
+    negative_cache_error_rate__doc = "Upper bound on the rate at which the negative cache reports a live slate as expired."
+
+    negative_cache_lifetime = 5
+    negative_cache_lifetime__doc = "Minutes after which the negative cache forgets an expired slate name.  Bounds how stale the cache may be if another process creates a slate with that name."
+
+    readonly = False
+    readonly__doc = "If True, all writes raise ReadOnlySlateError"
+
+    track_changes = False
+    track_changes__doc = "Default for the track argument of get(), setdefault() and item access.  If True, dict and list values are returned as change-tracking proxies."
  
-    def __init__(self, name, timeout=missing):
+    def __init__(self, name, timeout=missing, storage=None):
         """Initializes the Slate, and wipes expired data if necessary.
         Also updates the Slate's Timestamp (preventing it from expiring for
         timeout minutes), and if timeout is not missing and is not equal
         to the stored timeout, will update the timeout record.
+
+        If storage is given, it is used as is (see SlateStorage.peek).
         """
         self.name = name
         self._data = {}
+        self._tracked = {}
+        self._expires = {}
+        self._dirty = set()
+        self._registered = False
         
         if not timeout is missing:
             self.timeout = timeout
 
+        if storage is not None:
+            self.storage = storage
+            log('Slate peeked: {0}'.format(repr(self.storage)))
+            return
+
         self.storage = Slate.storage_class(self.name, self.timeout)
+        if Slate.negative_cache is not None:
+            # The storage constructor has created the slate if needed
+            Slate.negative_cache.discard(self.name)
         log('Slate loaded: {0}'.format(repr(self.storage)))
 
     @classmethod
-    def is_expired(cls, id):
-        """Returns True if the given Slate identifier is expired or non-existant."""
-        return Slate.storage_class.is_expired(id)
+    def is_expired(cls, id, negative_cache=True):
+        """Returns True if the given Slate identifier is expired or non-existant.
+        Consults the negative cache (if enabled) before the storage medium,
+        unless negative_cache is False.  Pass False for names that cannot
+        be replayed (such as freshly generated session ids), so that they
+        neither evict remembered names nor skew the hit rate.
+        """
+        cache = Slate.negative_cache if negative_cache else None
+        if cache is not None:
+            if id in cache:
+                return True
+            # Lets add() tell whether the slate was created meanwhile
+            discard_mark = cache.discard_mark
+        result = Slate.storage_class.is_expired(id)
+        if result and cache is not None:
+            cache.add(id, discard_mark)
+        return result
 
     @classmethod
     def setup(cls, **kwargs):
@@ -78,6 +139,15 @@ class Slate(object): #PY3 , metaclass=cherrypy._AttributeDocstrings):
         #storage_class must have been passed in kwargs
         cls.storage_class.setup(kwargs.get('storage_conf', {}))
 
+        if cls.negative_cache_size:
+            cls.negative_cache = DecayingBloomFilter(
+                cls.negative_cache_size
+                , error_rate=cls.negative_cache_error_rate
+                , lifetime=cls.negative_cache_lifetime
+                )
+        else:
+            cls.negative_cache = None
+
         if cls.clean_freq and not hasattr(cls.storage_class, 'clean_thread'):
             # clean_up is in instancemethod and not a classmethod,
             # so that tool config can be accessed inside the method.
@@ -90,42 +160,82 @@ class Slate(object): #PY3 , metaclass=cherrypy._AttributeDocstrings):
     
     def expire(self):
         """Delete stored session data."""
+        self._check_writable()
+        self._forget()
         self.storage.expire()
     
     def __getitem__(self, key):
-        result = self.storage.get(key, missing)
+        result = self.get(key, missing)
         if result is missing:
             raise KeyError(key)
         return result
     
     def __setitem__(self, key, value):
-        self.storage.set(key, value)
+        self._check_writable()
+        self._forget(key)
+        self.storage.set(key, tracking.untrack(value))
+
+    def set(self, key, value, ttl=None):
+        """Set the specified key to value.  If ttl is not None, the key
+        expires on its own after ttl minutes, independently of the slate's
+        timeout.  Setting a key without a ttl clears any previous ttl.
+        """
+        self._check_writable()
+        self._forget(key)
+        self.storage.set(key, tracking.untrack(value), ttl)
     
     def __delitem__(self, key):
+        self._check_writable()
+        self._forget(key)
         result = self.storage.pop(key, missing)
         if result is missing:
             raise KeyError(key)
 
-    def get(self, key, default=None):
-        """Return the value for the specified key, or default"""
-        return self.storage.get(key, default)
+    def get(self, key, default=None, track=None):
+        """Return the value for the specified key, or default.  If track
+        (default track_changes) is True, dict and list values are returned
+        as change-tracking proxies.
+        """
+        if key in self._tracked:
+            return self._tracked[key]
+        return self._track(key, self.storage.get(key, default), default, track)
     
     def pop(self, key, default=None):
         """Remove the specified key and return the corresponding value.
         If key is not found, default is returned.
         """
+        self._check_writable()
+        if key in self._tracked:
+            result = tracking.untrack(self._tracked[key])
+            self._forget(key)
+            self.storage.pop(key, None)
+            return result
         return self.storage.pop(key, default)
     
     def update(self, d):
         """D.update(E) -> None.  Update D from E: for k in E: D[k] = E[k]."""
-        self.storage.update(d)
+        self._check_writable()
+        for k in d:
+            self._forget(k)
+        self.storage.update(dict((k, tracking.untrack(d[k])) for k in d))
     
-    def setdefault(self, key, default=None):
+    def setdefault(self, key, default=None, track=None):
         """D.setdefault(k[,d]) -> D.get(k,d), also set D[k]=d if k not in D."""
-        return self.storage.setdefault(key, default)
+        if key in self._tracked:
+            return self._tracked[key]
+        if self.readonly:
+            result = self.get(key, missing, track)
+            if result is missing:
+                self._check_writable()
+            return result
+        return self._track(key
+            , self.storage.setdefault(key, tracking.untrack(default))
+            , missing, track)
     
     def clear(self):
         """D.clear() -> None.  Remove all items from D."""
+        self._check_writable()
+        self._forget()
         self.storage.clear()
     
     def keys(self):
@@ -134,15 +244,86 @@ class Slate(object): #PY3 , metaclass=cherrypy._AttributeDocstrings):
     
     def items(self):
         """D.items() -> list of D's (key, value) pairs, as 2-tuples."""
-        return self.storage.items()
+        return [ (k, self._tracked.get(k, v)) for k, v in self.storage.items() ]
     
     def values(self):
         """D.values() -> list of D's values."""
-        return self.storage.values()
+        return [ v for _, v in self.items() ]
+
+    def flush(self):
+        """Write back any tracked values that were modified.  Each modified
+        key is written once, keeping its ttl; keys whose ttl ran out since
+        they were read are not written.  Called at the end of each
+        request by the tool; call it yourself when using tracked values
+        outside of a request.
+        """
+        if not self._dirty:
+            return
+        ttls = self.storage.key_ttls()
+        now = time.time()
+        expired = []
+        for key in self._dirty:
+            ttl = ttls.get(key)
+            expires = self._expires.get(key)
+            if expires is not None:
+                # The storage no longer knows the ttl once it has run out
+                ttl = (expires - now) / 60
+                if ttl <= 0:
+                    expired.append(key)
+                    continue
+            self.storage.set(key, tracking.untrack(self._tracked[key]), ttl)
+        log('Slate {0} flushed {1}{2}'.format(self.name
+            , sorted(self._dirty.difference(expired))
+            , ', dropped expired {0}'.format(sorted(expired)) if expired else ''))
+        self._dirty.clear()
+        for key in expired:
+            self._forget(key)
+
+    def _track(self, key, value, default, track):
+        if track is None:
+            track = self.track_changes
+        if not track or value is default:
+            return value
+        if self.readonly:
+            on_change = self._check_writable
+        else:
+            on_change = lambda: self._dirty.add(key)
+        proxy = tracking.track(value, on_change)
+        if proxy is not value:
+            self._tracked[key] = proxy
+            if not self.readonly:
+                ttl = self.storage.key_ttls().get(key)
+                if ttl is not None:
+                    self._expires[key] = time.time() + ttl * 60
+            if not self._registered:
+                self._registered = True
+                session = getattr(cherrypy.serving, 'session', None)
+                if session is not None:
+                    session.tracked_slates.append(self)
+        return proxy
+
+    def _check_writable(self):
+        if self.readonly:
+            raise ReadOnlySlateError(
+                'Slate {0} is read-only'.format(self.name))
+
+    def _forget(self, key=missing):
+        """Stop tracking key (or all keys), because it was written directly"""
+        if key is missing:
+            self._tracked.clear()
+            self._expires.clear()
+            self._dirty.clear()
+        else:
+            self._tracked.pop(key, None)
+            self._expires.pop(key, None)
+            self._dirty.discard(key)
 
 class SlateStorage(object): #PY3 , metaclass=cherrypy._AttributeDocstring):
     """The base class for slate storage types"""
 
+    # Lets subclasses define __slots__ for compact instances
+    __slots__ = ()
+
     name = None
     name__doc = "The slate's name"
 
@@ -157,8 +338,11 @@ class SlateStorage(object): #PY3 , metaclass=cherrypy._AttributeDocstring):
         """
         raise NotImplementedError()
 
-    def set(self, key, value):
-        """Sets the given key to the given value"""
+    def set(self, key, value, ttl=None):
+        """Sets the given key to the given value.  If ttl is not None, the
+        key must be hidden from reads after ttl minutes and eventually purged
+        (lazily or in clean_up).
+        """
         raise NotImplementedError()
 
     def get(self, key, default):
@@ -205,13 +389,40 @@ class SlateStorage(object): #PY3 , metaclass=cherrypy._AttributeDocstring):
             result = default
         return result
 
+    def key_ttls(self):
+        """Returns a dict of { key: minutes remaining } for keys set with a
+        ttl.  Override if the storage supports ttls.
+        """
+        return {}
+
+    @classmethod
+    def peek(cls, name, timeout):
+        """Returns storage for the named slate without creating it or
+        updating its timestamp / expiration, or None if it is expired or
+        non-existant.  Override to avoid the write that the constructor
+        may perform.
+        """
+        if cls.is_expired(name):
+            return None
+        return cls(name, timeout)
+
+    @classmethod
+    def new_shard(cls, name):
+        """Returns a subclass of this storage type that can be set up
+        independently, for use as one of ShardedSlate's shards.  Override
+        to give the subclass its own copies of class-level state.
+        """
+        return type('{0}_{1}'.format(cls.__name__, name), (cls,), { '__slots__': () })
+
     @classmethod
     def setup(cls, config):
         """Set up slate storage medium according to passed config"""
 
     @classmethod
     def clean_up(cls):
-        """Clean up expired sessions (timestamp + timeout < present)"""
+        """Clean up expired sessions (timestamp + timeout < present) and
+        expired keys.
+        """
         raise NotImplementedError()
 
     @classmethod
@@ -220,20 +431,72 @@ class SlateStorage(object): #PY3 , metaclass=cherrypy._AttributeDocstring):
         raise NotImplementedError()
 
 class RamSlate(SlateStorage):
+    """Storing slates in process memory.
+
+    Available params in storage_conf:
+        snapshot_file: If set, the RAM store is periodically written to
+            this file and reloaded from it at startup, so that sessions
+            survive restarts
+        snapshot_freq: Minutes between snapshots (default 5)
+        pickle_values: If True, values are stored pickled, which is more
+            compact for large or deeply nested values (default False)
+
+    Each RamSlate instance is the cached record for its slate, so that
+    constructing one for a request allocates nothing unless the slate is
+    new or expired.  Key names are interned, so that a key used by every
+    session is stored once.
+    """
+
+    __slots__ = ('name', 'timestamp', 'timeout', 'data', 'ttl')
     
     # Class-level objects. Don't rebind these!
     cache = {}
 
+    snapshot_file = None
+    snapshot_file__doc = "Path of the snapshot file, or None if snapshots are disabled"
+
+    snapshot_magic = 'LGSLATES-RAM-2'
+    snapshot_magic__doc = "Header identifying the snapshot format version"
+
+    snapshot_lock = threading.Lock()
+    snapshot_lock__doc = "Serializes snapshot writers (never taken by request threads)"
+
+    pickle_values = False
+    pickle_values__doc = "True if values are stored pickled"
+
+    def __new__(cls, name, timeout):
+        now = time.time()
+        record = cls.cache.get(name)
+        if record is None or record._expired(now):
+            record = cls._new_record(name)
+            cls.cache[name] = record
+        record.timestamp = now
+        record.timeout = timeout
+        return record
+
     def __init__(self, name, timeout):
-        self.name = name
-        if RamSlate.is_expired(name):
-            self.record = self.cache[name] = {}
-        else:
-            self.record = self.cache.setdefault(name, {})
+        """Everything is done in __new__"""
+
+    @classmethod
+    def peek(cls, name, timeout):
+        record = cls.cache.get(name)
+        if record is None or record._expired(time.time()):
+            return None
+        return record
 
-        self.record['timestamp'] = time.time()
-        self.record['timeout'] = timeout
-        self.data = self.record.setdefault('data', {})
+    @classmethod
+    def _new_record(cls, name):
+        record = object.__new__(cls)
+        record.name = name
+        record.timestamp = None
+        record.timeout = None
+        record.data = {}
+        record.ttl = None
+        return record
+
+    def _expired(self, now):
+        return self.timeout is not None \
+            and self.timestamp + self.timeout * 60 < now
 
     def __str__(self):
         return "RAM{0}".format(self.data)
@@ -241,47 +504,118 @@ class RamSlate(SlateStorage):
     def __repr__(self):
         return str(self)
 
-    def set(self, key, value):
+    def set(self, key, value, ttl=None):
+        if type(key) is str:
+            key = intern(key)
+        if self.pickle_values:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
         self.data[key] = value
+        ttls = self.ttl
+        if ttl is not None:
+            expires = time.time() + ttl * 60
+            if ttls is None:
+                ttls = self.ttl = {}
+            ttls[key] = expires
+        elif ttls:
+            ttls.pop(key, None)
 
     def get(self, key, default):
-        return self.data.get(key, default)
+        if self._key_expired(key):
+            return default
+        result = self.data.get(key, missing)
+        if result is missing:
+            return default
+        if self.pickle_values:
+            result = pickle.loads(result)
+        return result
 
     def pop(self, key, default):
-        return self.data.pop(key, default)
+        if self._key_expired(key):
+            return default
+        if self.ttl:
+            self.ttl.pop(key, None)
+        result = self.data.pop(key, missing)
+        if result is missing:
+            return default
+        if self.pickle_values:
+            result = pickle.loads(result)
+        return result
 
     def clear(self):
-        self.data = self.record['data'] = {}
+        self.data = {}
+        self.ttl = None
 
     def keys(self):
+        self._purge_expired_keys()
         return self.data.keys()
 
     def items(self):
+        self._purge_expired_keys()
+        if self.pickle_values:
+            return [ (k, pickle.loads(v)) for k, v in self.data.items() ]
         return self.data.items()
 
     def values(self):
+        self._purge_expired_keys()
+        if self.pickle_values:
+            return [ pickle.loads(v) for v in self.data.values() ]
         return self.data.values()
+
+    def _key_expired(self, key):
+        """Returns True (and purges key) if key was set with a ttl that has
+        passed.
+        """
+        ttls = self.ttl
+        if not ttls:
+            return False
+        expires = ttls.get(key)
+        if expires is None or expires >= time.time():
+            return False
+        ttls.pop(key, None)
+        self.data.pop(key, None)
+        return True
+
+    def key_ttls(self):
+        self._purge_expired_keys()
+        now = time.time()
+        return dict((k, (e - now) / 60) for k, e in (self.ttl or {}).items())
+
+    @classmethod
+    def new_shard(cls, name):
+        return type('{0}_{1}'.format(cls.__name__, name), (cls,), {
+            '__slots__': ()
+            ,'cache': {}
+            ,'snapshot_lock': threading.Lock()
+            })
+
+    def _purge_expired_keys(self):
+        ttls = self.ttl
+        if ttls:
+            for key in list(ttls.keys()):
+                self._key_expired(key)
     
     def expire(self):
         self._expire(self.name)
 
     @classmethod
     def is_expired(cls, name):
-        obj = cls.cache.get(name, None)
-        if obj is None:
-            return True
-        if obj['timeout'] is None:
-            return False
-        if obj['timestamp'] + obj['timeout'] * 60 < time.time():
+        record = cls.cache.get(name, None)
+        if record is None:
             return True
-        return False
+        return record._expired(time.time())
     
     @classmethod
     def clean_up(cls):
-        """Clean up expired sessions."""
+        """Clean up expired sessions, and expired keys of live ones."""
         for id in list(cls.cache.keys()):
             if cls.is_expired(id):
                 cls._expire(id)
+                continue
+            # Scanning each record's ttls keeps set() free of any shared
+            # index, however often a key is re-set
+            record = cls.cache.get(id, None)
+            if record is not None and record.ttl:
+                record._purge_expired_keys()
         log('Cleaned expired sessions')
 
     @classmethod
@@ -290,6 +624,129 @@ class RamSlate(SlateStorage):
             del cls.cache[id]
         except KeyError:
             pass
+
+    @classmethod
+    def setup(cls, conf):
+        cls.pickle_values = conf.get('pickle_values', False)
+        cls.snapshot_file = conf.get('snapshot_file', None)
+        if cls.snapshot_file is None:
+            return
+
+        # Checked in __dict__ rather than inherited, since shards are
+        # subclasses
+        if 'snapshot_loaded' not in cls.__dict__:
+            cls.snapshot_loaded = True
+            # Loaded before the HTTP server starts accepting requests; if
+            # the engine is already running, load now
+            cherrypy.engine.subscribe('start', cls.load_snapshot, priority=40)
+            states = cherrypy.engine.states
+            if cherrypy.engine.state in (states.STARTING, states.STARTED):
+                cls.load_snapshot()
+
+        if 'snapshot_thread' not in cls.__dict__:
+            t = cherrypy.process.plugins.Monitor(
+                cherrypy.engine, cls.save_snapshot
+                , conf.get('snapshot_freq', 5) * 60
+                , name='RamSlate snapshot')
+            t.subscribe()
+            cls.snapshot_thread = t
+            t.start()
+            # One last snapshot on shutdown, after request threads stop
+            cherrypy.engine.subscribe('stop', cls.save_snapshot, priority=80)
+
+    @classmethod
+    def save_snapshot(cls):
+        """Write all slates to snapshot_file.  Request threads are never
+        blocked: each record's data is shallow-copied on its own, and the
+        file is written to a temporary path and then renamed into place.
+        """
+        path = cls.snapshot_file
+        if path is None:
+            return
+        with cls.snapshot_lock:
+            cls._write_snapshot(path)
+
+    @classmethod
+    def _write_snapshot(cls, path):
+        tmp_path = path + '.tmp'
+        count = 0
+        with open(tmp_path, 'wb') as f:
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.dump((cls.snapshot_magic, cls.pickle_values))
+            for name, record in list(cls.cache.items()):
+                try:
+                    entry = (
+                        name
+                        , record.timestamp
+                        , record.timeout
+                        , dict(record.data)
+                        , dict(record.ttl or {})
+                        )
+                    pickler.dump(entry)
+                except Exception as e:
+                    # Typically a value changed while being pickled; it
+                    # will be in the next snapshot.
+                    log('Snapshot skipped {0}: {1!r}'.format(name, e))
+                # Don't let the memo hold every value in the store
+                pickler.clear_memo()
+                count += 1
+            # On disk before it replaces the last good snapshot
+            f.flush()
+            os.fsync(f.fileno())
+        _replace_file(tmp_path, path)
+        log('Snapshot of {0} slates written to {1}'.format(count, path))
+
+    @classmethod
+    def load_snapshot(cls):
+        """Stream slates from snapshot_file into the cache, skipping slates
+        and keys that expired while the process was down.  Slates already
+        in the cache are kept.
+        """
+        path = cls.snapshot_file
+        if path is None or not os.path.exists(path):
+            return
+        now = time.time()
+        loaded = 0
+        with open(path, 'rb') as f:
+            unpickler = pickle.Unpickler(f)
+            try:
+                header = unpickler.load()
+                if not isinstance(header, tuple) \
+                        or header[0] != cls.snapshot_magic:
+                    log('Ignoring snapshot with unknown format: ' + path)
+                    return
+                convert = None
+                if header[1] != cls.pickle_values:
+                    # pickle_values was changed since the snapshot
+                    if cls.pickle_values:
+                        convert = lambda v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL)
+                    else:
+                        convert = pickle.loads
+                while True:
+                    name, timestamp, timeout, data, ttls = unpickler.load()
+                    if timeout is not None and timestamp + timeout * 60 < now:
+                        continue
+                    for key, expires in list(ttls.items()):
+                        if expires < now:
+                            del ttls[key]
+                            data.pop(key, None)
+                    record = cls._new_record(name)
+                    record.timestamp = timestamp
+                    record.timeout = timeout
+                    if convert is not None:
+                        data = dict((k, convert(v)) for k, v in data.items())
+                    record.data = dict((
+                        intern(k) if type(k) is str else k, v)
+                        for k, v in data.items())
+                    record.ttl = ttls or None
+                    cls.cache.setdefault(name, record)
+                    loaded += 1
+            except EOFError:
+                pass
+            except Exception as e:
+                # Keep whatever was read from a truncated snapshot
+                log('Snapshot {0} unreadable: {1!r}'.format(path, e))
+        log('Loaded {0} slates from snapshot {1}'.format(loaded, path))
     
     def __len__(self):
         """Return the number of active sessions."""
@@ -303,22 +760,61 @@ class PymongoSlate(SlateStorage):
         port: Port to connect with
         db: Database containing slates collection
         collection: Collection containing slates
+        offload_size: Pickled values larger than this many bytes are stored
+            out of line in a side collection and only fetched when read
+            (default None, which stores everything inline)
+        blob_collection: Collection for out of line values (defaults to
+            collection + '_blobs')
+        replica_set: Name of the replica set that host belongs to; a
+            ReplicaSetConnection is opened instead of a plain Connection
+            (default None)
+        peek_read_preference: Name of a pymongo.ReadPreference (e.g.
+            'SECONDARY_PREFERRED') used to load sessions in the readonly and
+            notouch modes, which may then see slightly stale data (defaults
+            to the connection's read preference).  Requires replica_set,
+            since a plain Connection only talks to a single server
+
+    Out of line values are referenced from data.<key> as { 'blob': <id> },
+    where <id> is new for every write.  A blob is only removed by whichever
+    update replaced or removed its reference (including removing or
+    re-creating the whole slate), so concurrent writes never remove each
+    other's values.
+
+    Keys set with a ttl have their expiration stored under ttl.<key>;
+    ttl_next holds the earliest of those so that clean_up can find slates
+    with expired keys through an index.
     """
 
     conn = None
     conn__doc = "PyMongo collection object"
 
+    blobs = None
+    blobs__doc = "PyMongo collection object for out of line values"
+
+    offload_size = None
+    offload_size__doc = "Size in bytes above which pickled values are stored in blobs, or None to disable offloading"
+
+    has_blobs = False
+    has_blobs__doc = "True if offloading is enabled, or blobs written while it was remain; writes then free the blobs they dereference"
+
+    peek_read_preference = None
+    peek_read_preference__doc = "pymongo read preference used by peek, or None for the connection's"
+
+    core_fields = {
+        '_id': 1
+        ,'time': 1
+        ,'expire': 1
+        ,'data.auth': 1
+        ,'ttl': 1
+        }
+    core_fields__doc = "Fields fetched when a slate is opened"
+
     def __init__(self, name, timeout):
         self.name = name
         self._cache = { 'auth': None }
+        self._ttl = {}
         
-        get_fields = {
-            '_id': 1
-            ,'time': 1
-            ,'expire': 1
-            ,'data.auth': 1
-            }
-        core = self.conn.find_one({ 'name': self.name }, get_fields)
+        core = self.conn.find_one({ 'name': self.name }, self.core_fields)
         now = datetime.datetime.utcnow()
 
         if core is None or core.get('expire', now) < now:
@@ -329,13 +825,19 @@ class PymongoSlate(SlateStorage):
                 }
             if timeout is not None:
                 new_dict['expire'] = now + datetime.timedelta(minutes=timeout)
-            if core is not None:
+            if core is not None and self.has_blobs:
                 new_dict['_id'] = core['_id']
-            self.conn.save(new_dict)
+                old = self.conn.find_and_modify(
+                    { '_id': core['_id'] }, new_dict, upsert=True
+                    , fields={ 'data': 1 })
+                self._remove_referenced_blobs(old)
+            else:
+                if core is not None:
+                    new_dict['_id'] = core['_id']
+                self.conn.save(new_dict)
             self._id = new_dict['_id']
         else:
-            self._id = core['_id']
-            self._cache.update(core.get('data', {}))
+            self._load(core)
 
             #We also have to handle the case where timeout
             #has changed from/to None
@@ -363,70 +865,254 @@ class PymongoSlate(SlateStorage):
                     updates['$unset'] = { 'expire': 1 }
                 self.conn.update({ '_id': self._id }, updates)
 
+    def _load(self, core):
+        self._id = core['_id']
+        self._cache.update(core.get('data', {}))
+        self._ttl = core.get('ttl', {})
+
+    @classmethod
+    def peek(cls, name, timeout):
+        kwargs = {}
+        if cls.peek_read_preference is not None:
+            kwargs['read_preference'] = cls.peek_read_preference
+        core = cls.conn.find_one({ 'name': name }, cls.core_fields, **kwargs)
+        now = datetime.datetime.utcnow()
+        if core is None or core.get('expire', now) < now:
+            return None
+        self = cls.__new__(cls)
+        self.name = name
+        self._cache = { 'auth': None }
+        self._load(core)
+        return self
+
     def __str__(self):
         return "PYMONGO{0}".format(self._id)
 
     def __repr__(self):
         return str(self)
 
-    def set(self, key, value):
+    def set(self, key, value, ttl=None):
         pickled = pickle.dumps(value).encode('utf-8')
+        expires = None
+        if ttl is not None:
+            expires = datetime.datetime.utcnow() \
+                + datetime.timedelta(minutes=ttl)
+
+        offloaded = self.offload_size is not None \
+            and len(pickled) > self.offload_size
+        if offloaded:
+            # Written before the reference so that readers never see a
+            # reference without its value.
+            blob_id = self._blob_id(key)
+            self.blobs.insert({
+                '_id': blob_id
+                ,'slate': self._id
+                ,'value': pickled
+                })
+            stored = { 'blob': blob_id }
+        else:
+            stored = pickled
 
         if key in self._cache:
-            self._cache[key] = pickled
+            self._cache[key] = stored
 
-        self.conn.update(
-            { '_id': self._id }
-            , { '$set': { 'data.' + key: pickled } }
-            )
+        updates = { '$set': { 'data.' + key: stored } }
+        if expires is not None:
+            updates['$set']['ttl.' + key] = expires
+            updates['$min'] = { 'ttl_next': expires }
+            self._ttl[key] = expires
+        else:
+            updates['$unset'] = { 'ttl.' + key: 1 }
+            self._ttl.pop(key, None)
+
+        if not self._update_key({ '_id': self._id }, updates, key) \
+                and offloaded:
+            # The slate was removed meanwhile; nothing references the blob
+            self.blobs.remove({ '_id': blob_id })
 
     def get(self, key, default):
         if key in self._cache:
             result = self._cache[key]
             if result is None:
                 result = default
+            expires = self._ttl.get(key)
         else:
-            doc = self.conn.find_one({ '_id': self._id }, { 'data.' + key: 1 })
+            doc = self.conn.find_one(
+                { '_id': self._id }
+                , { 'data.' + key: 1, 'ttl.' + key: 1 }
+                )
             result = doc.get('data', {}).get(key, default)
+            expires = doc.get('ttl', {}).get(key)
+
+        if expires is not None and expires < datetime.datetime.utcnow():
+            self._purge_key(key, expires)
+            result = default
+
+        if isinstance(result, dict):
+            blob = self.blobs.find_one({ '_id': result['blob'] }, { 'value': 1 })
+            result = default if blob is None else blob['value']
 
         if result is not default:
-            result = pickle.loads(str(result.decode('utf-8')))
+            result = self._unpickle(result)
         return result
 
     def pop(self, key, default):
         result = self.get(key, default)
-        self.conn.update({ '_id': self._id }, { '$unset': { 'data.' + key: 1 } })
+        self._update_key(
+            { '_id': self._id }
+            , { '$unset': { 'data.' + key: 1, 'ttl.' + key: 1 } }
+            , key
+            )
+        self._ttl.pop(key, None)
         return result
 
     def clear(self):
-        self.conn.update({ '_id': self._id }, { '$unset': { 'data': 1 } })
+        spec = { '_id': self._id }
+        updates = { '$unset': { 'data': 1, 'ttl': 1, 'ttl_next': 1 } }
+        if self.has_blobs:
+            old = self.conn.find_and_modify(spec, updates, fields={ 'data': 1 })
+            self._remove_referenced_blobs(old)
+        else:
+            self.conn.update(spec, updates)
+        self._ttl = {}
 
     def keys(self):
-        data = self.conn.find_one({ '_id': self._id }, { 'data': 1 })
-        return data['data'].keys()
+        return self._live_data().keys()
 
     def items(self):
-        data = self.conn.find_one({ '_id': self._id }, { 'data': 1 })
-        return data['data'].items()
+        data = self._live_data()
+        self._load_blobs(data)
+        return [ (k, self._unpickle(v)) for k, v in data.items() ]
 
     def values(self):
-        data = self.conn.find_one({ '_id': self._id }, { 'data': 1 })
-        return data['data'].values()
+        data = self._live_data()
+        self._load_blobs(data)
+        return [ self._unpickle(v) for v in data.values() ]
+
+    def key_ttls(self):
+        now = datetime.datetime.utcnow()
+        result = {}
+        for key, expires in self._ttl.items():
+            remaining = expires - now
+            result[key] = (remaining.days * 86400 + remaining.seconds) / 60.0
+        return result
+
+    def _live_data(self):
+        """Returns the data subdocument, without any expired keys"""
+        doc = self.conn.find_one({ '_id': self._id }, { 'data': 1, 'ttl': 1 })
+        data = doc.get('data', {})
+        now = datetime.datetime.utcnow()
+        for key, expires in doc.get('ttl', {}).items():
+            if expires < now:
+                self._purge_key(key, expires)
+                data.pop(key, None)
+        return data
+
+    def _purge_key(self, key, expires):
+        """Lazily removes an expired key.  Only matches if the key has not
+        been re-set since it was read.
+        """
+        self._ttl.pop(key, None)
+        if key in self._cache:
+            self._cache[key] = None
+        self._update_key(
+            { '_id': self._id, 'ttl.' + key: expires }
+            , { '$unset': { 'data.' + key: 1, 'ttl.' + key: 1 } }
+            , key
+            )
+
+    @classmethod
+    def _update_key(cls, spec, updates, key):
+        """Applies updates, which replace or remove data.<key>, to the slate
+        matching spec.  If the value they replaced was out of line, its blob
+        is removed; no other update can have been given that reference, so
+        this never removes a value that is still referenced.
+
+        Returns False if no slate matched spec, which is only detected
+        while has_blobs is set.
+        """
+        if not cls.has_blobs:
+            cls.conn.update(spec, updates)
+            return True
+        old = cls.conn.find_and_modify(spec, updates, fields={ 'data.' + key: 1 })
+        cls._remove_referenced_blobs(old)
+        return old is not None
+
+    def _blob_id(self, key):
+        return '{0}/{1}/{2}'.format(
+            self._id, key, binascii.hexlify(os.urandom(8)).decode('ascii'))
+
+    def _load_blobs(self, data):
+        """Replaces out of line references in data with their values,
+        using a single query.  References to missing blobs are dropped.
+        """
+        refs = dict(
+            (v['blob'], k) for k, v in data.items() if isinstance(v, dict)
+            )
+        if not refs:
+            return
+        for blob in self.blobs.find({ '_id': { '$in': list(refs.keys()) } }):
+            data[refs.pop(blob['_id'])] = blob['value']
+        for k in refs.values():
+            del data[k]
+
+    def _unpickle(self, stored):
+        return pickle.loads(str(stored.decode('utf-8')))
+
+    @classmethod
+    def _remove_referenced_blobs(cls, doc):
+        """Removes the blobs referenced from doc's data, where doc is the
+        former version of a slate (or None)
+        """
+        if doc is None:
+            return
+        ids = [ v['blob'] for v in doc.get('data', {}).values()
+            if isinstance(v, dict) ]
+        if ids:
+            cls.blobs.remove({ '_id': { '$in': ids } })
+
     
     def expire(self):
-        self.conn.remove(self._id)
+        if self.has_blobs:
+            old = self.conn.find_and_modify(
+                { '_id': self._id }, remove=True, fields={ 'data': 1 })
+            self._remove_referenced_blobs(old)
+        else:
+            self.conn.remove(self._id)
 
     @classmethod
     def setup(cls, conf):
         import pymongo
-        c = pymongo.Connection(
-          host=conf.get('host', None)
-          ,port=conf.get('port', None)
-          )
+        replica_set = conf.get('replica_set', None)
+        peek_pref = conf.get('peek_read_preference', None)
+        if peek_pref is not None and replica_set is None:
+            raise ValueError("peek_read_preference requires replica_set")
+        if replica_set is not None:
+            seed = conf.get('host', None) or 'localhost'
+            if conf.get('port', None) is not None:
+                seed = '{0}:{1}'.format(seed, conf['port'])
+            c = pymongo.ReplicaSetConnection(seed, replicaSet=replica_set)
+        else:
+            c = pymongo.Connection(
+              host=conf.get('host', None)
+              ,port=conf.get('port', None)
+              )
         d = c[conf['db']]
         cls.conn = d[conf['collection']]
         cls.conn.ensure_index([ ('name', 1) ], background=True)
         cls.conn.ensure_index([ ('expire', 1) ], background=True)
+        cls.conn.ensure_index([ ('ttl_next', 1) ], background=True, sparse=True)
+
+        # blobs is always available so that values offloaded before
+        # offload_size was unset remain readable
+        cls.offload_size = conf.get('offload_size', None)
+        cls.blobs = d[conf.get('blob_collection', conf['collection'] + '_blobs')]
+        cls.has_blobs = cls.offload_size is not None \
+            or cls.blobs.find_one({}, { '_id': 1 }) is not None
+
+        if peek_pref is not None:
+            peek_pref = getattr(pymongo.ReadPreference, peek_pref)
+        cls.peek_read_preference = peek_pref
 
     @classmethod
     def is_expired(cls, name):
@@ -440,9 +1126,280 @@ class PymongoSlate(SlateStorage):
     @classmethod
     def clean_up(cls):
         now = datetime.datetime.utcnow()
-        cls.conn.remove({ 'expire': { '$lt': now } })
+        if cls.has_blobs:
+            # One at a time, freeing the blobs referenced by exactly the
+            # version of each slate that was removed
+            while True:
+                old = cls.conn.find_and_modify(
+                    { 'expire': { '$lt': now } }, remove=True
+                    , fields={ 'data': 1 })
+                if old is None:
+                    break
+                cls._remove_referenced_blobs(old)
+        else:
+            cls.conn.remove({ 'expire': { '$lt': now } })
+
+        for doc in cls.conn.find({ 'ttl_next': { '$lt': now } }, { 'ttl': 1 }):
+            remaining = []
+            for key, expires in doc.get('ttl', {}).items():
+                if expires < now:
+                    cls._update_key(
+                        { '_id': doc['_id'], 'ttl.' + key: expires }
+                        , { '$unset': { 'data.' + key: 1, 'ttl.' + key: 1 } }
+                        , key
+                        )
+                else:
+                    remaining.append(expires)
+            if remaining:
+                updates = { '$set': { 'ttl_next': min(remaining) } }
+            else:
+                updates = { '$unset': { 'ttl_next': 1 } }
+            cls.conn.update({ '_id': doc['_id'] }, updates)
+
+            # The overwrite above may have discarded the $min of a key set
+            # concurrently with a ttl.  Such keys are in a fresh read, and
+            # any set after that read applies its own $min after ours.
+            fresh = cls.conn.find_one({ '_id': doc['_id'] }, { 'ttl': 1 })
+            if fresh is not None and fresh.get('ttl'):
+                cls.conn.update(
+                    { '_id': doc['_id'] }
+                    , { '$min': { 'ttl_next': min(fresh['ttl'].values()) } }
+                    )
         log('Cleaned expired sessions')
 
+class ShardedSlate(SlateStorage):
+    """Spreading slates across several child storages (shards), any of
+    which may be of any other storage type.  Each slate name is routed
+    to one shard through a consistent hash ring.
+
+    Available params in storage_conf:
+        shards: dict of { shard name: { 'storage_type': ..., 'storage_conf':
+            ... } }, where storage_type and storage_conf are as for the
+            tool (storage_type defaults to 'ram')
+        ring: List of the shard names that new slates are placed on
+            (defaults to all shards)
+        previous_ring: List of the shard names that made up the ring before
+            it was last changed.  When set, a slate that is not found on
+            its new shard but is alive on its previous one is moved
+            on first access (lazy online rebalancing).  Remove it once
+            the old shards have been drained or have expired.
+        replicas: Points per shard on the ring (default 64)
+
+    Shard names determine placement, so keep them stable.
+    """
+
+    shards = {}
+    shards__doc = "dict of { shard name: storage class }"
+
+    shard_confs = {}
+    shard_confs__doc = "dict of { shard name: shard config }, so that shards whose config is unchanged are kept when setup is called again"
+
+    ring = None
+    ring__doc = "ConsistentHashRing of the current shards"
+
+    previous_ring = None
+    previous_ring__doc = "ConsistentHashRing before the last ring change, or None when not rebalancing"
+
+    def __init__(self, name, timeout):
+        self.name = name
+        shard = self.ring.get(name)
+        if self.previous_ring is not None:
+            old_shard = self.previous_ring.get(name)
+            if old_shard is not shard and shard.is_expired(name) \
+                    and not old_shard.is_expired(name):
+                self.storage = self._migrate(old_shard, shard, timeout)
+                return
+        self.storage = shard(name, timeout)
+
+    @classmethod
+    def peek(cls, name, timeout):
+        storage = cls.ring.get(name).peek(name, timeout)
+        if storage is None and cls.previous_ring is not None:
+            # Not migrated yet; read from the previous shard
+            storage = cls.previous_ring.get(name).peek(name, timeout)
+        if storage is None:
+            return None
+        self = cls.__new__(cls)
+        self.name = name
+        self.storage = storage
+        return self
+
+    def __str__(self):
+        return "SHARDED{0}".format(self.storage)
+
+    def __repr__(self):
+        return str(self)
+
+    def _migrate(self, old_shard, shard, timeout):
+        """Copies this slate from old_shard to shard, then expires it in
+        old_shard.  Returns the new storage.
+        """
+        old = old_shard(self.name, timeout)
+        ttls = old.key_ttls()
+        new = shard(self.name, timeout)
+        for key, value in old.items():
+            ttl = ttls.get(key)
+            if ttl is None or ttl > 0:
+                new.set(key, value, ttl)
+        old.expire()
+        log('Slate {0} moved from {1} to {2}'.format(
+            self.name, old_shard.__name__, shard.__name__))
+        return new
+
+    def set(self, key, value, ttl=None):
+        self.storage.set(key, value, ttl)
+
+    def get(self, key, default):
+        return self.storage.get(key, default)
+
+    def pop(self, key, default):
+        return self.storage.pop(key, default)
+
+    def clear(self):
+        self.storage.clear()
+
+    def keys(self):
+        return self.storage.keys()
+
+    def items(self):
+        return self.storage.items()
+
+    def values(self):
+        return self.storage.values()
+
+    def expire(self):
+        self.storage.expire()
+
+    def update(self, d):
+        self.storage.update(d)
+
+    def setdefault(self, key, default):
+        return self.storage.setdefault(key, default)
+
+    def key_ttls(self):
+        return self.storage.key_ttls()
+
+    @classmethod
+    def setup(cls, conf):
+        shards = {}
+        for name, shard_conf in conf['shards'].items():
+            if cls.shard_confs.get(name) == shard_conf:
+                shards[name] = cls.shards[name]
+                continue
+            storage_type = shard_conf.get('storage_type', 'ram')
+            base = globals()[storage_type.title() + 'Slate']
+            shard = base.new_shard(name)
+            shard.setup(shard_conf.get('storage_conf', {}))
+            shards[name] = shard
+        cls.shards = shards
+        cls.shard_confs = dict(conf['shards'])
+
+        replicas = conf.get('replicas', 64)
+        def make_ring(names):
+            return ConsistentHashRing(
+                dict((n, shards[n]) for n in names), replicas=replicas)
+        cls.ring = make_ring(conf.get('ring', shards.keys()))
+        if conf.get('previous_ring'):
+            cls.previous_ring = make_ring(conf['previous_ring'])
+        else:
+            cls.previous_ring = None
+
+    @classmethod
+    def is_expired(cls, name):
+        shard = cls.ring.get(name)
+        if cls.previous_ring is not None:
+            old_shard = cls.previous_ring.get(name)
+            if old_shard is not shard:
+                # Not _fan_out: this is on the request path, where starting
+                # threads costs more than the lookups, and the old shard is
+                # only consulted when the new one doesn't have the slate
+                return shard.is_expired(name) and old_shard.is_expired(name)
+        return shard.is_expired(name)
+
+    @classmethod
+    def clean_up(cls):
+        cls._fan_out(cls.shards.values(), lambda s: s.clean_up())
+
+    @classmethod
+    def _fan_out(cls, shards, func):
+        """Calls func(shard) for each shard in parallel, and returns the
+        results in order.  Re-raises the first exception, if any.  Starts a
+        thread per shard, so only for use off the request path.
+        """
+        shards = list(shards)
+        results = [ None ] * len(shards)
+        errors = []
+        def run(i, shard):
+            try:
+                results[i] = func(shard)
+            except Exception as e:
+                errors.append(e)
+        threads = [ threading.Thread(target=run, args=(i, shard))
+            for i, shard in enumerate(shards) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return results
+
+def _replace_file(src, dst):
+    """Atomically renames src to dst, replacing dst, and makes the rename
+    durable.
+    """
+    if os.name == 'nt':
+        # os.rename can't replace an existing file on Windows, and removing
+        # dst first would leave a window with neither file
+        import ctypes
+        move = ctypes.windll.kernel32.MoveFileExW
+        move.argtypes = (ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_uint32)
+        MOVEFILE_REPLACE_EXISTING = 0x1
+        MOVEFILE_WRITE_THROUGH = 0x8
+        if not move(src, dst, MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+        return
+
+    os.rename(src, dst)
+    fd = os.open(os.path.dirname(os.path.abspath(dst)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class _EmptyStorage(SlateStorage):
+    """Storage for a read-only view of a slate that does not exist"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return "EMPTY"
+
+    def set(self, key, value, ttl=None):
+        raise ReadOnlySlateError('Slate {0} does not exist'.format(self.name))
+
+    def get(self, key, default):
+        return default
+
+    def pop(self, key, default):
+        raise ReadOnlySlateError('Slate {0} does not exist'.format(self.name))
+
+    def clear(self):
+        pass
+
+    def keys(self):
+        return []
+
+    def items(self):
+        return []
+
+    def values(self):
+        return []
+
+    def expire(self):
+        pass
+
 class Session(Slate):
     """A container that maps session ID's to an underlying slate."""
 
@@ -458,12 +1415,23 @@ class Session(Slate):
     originalid = None
     originalid__doc = """Client-sent identifier for the session slate"""
 
-    def __init__(self, id=None, **kwargs):
+    tracked_slates = None
+    tracked_slates__doc = """Slates (including this session) that returned change-tracking proxies during this request, and are flushed by flush_tracked()"""
+
+    mode = None
+    mode__doc = """None for a normal session.  'notouch' loads the session without refreshing its expiration or creating it, and sends no cookie.  'readonly' does the same, and additionally raises ReadOnlySlateError on any write.  In both modes, a missing or expired session reads as empty, and cannot be written."""
+
+    def __init__(self, id=None, mode=None, **kwargs):
+        self.tracked_slates = []
         self.timeout = kwargs.pop('session_timeout', self.timeout)
         self.session_cookie = kwargs.get('session_cookie', self.session_cookie)
 
         self.originalid = id
         self.id = id
+        self.mode = mode
+        if mode is not None:
+            self._peek()
+            return
         #Check for expired session, and assign new identifier if
         #necessary.
         self._test_id()
@@ -475,6 +1443,10 @@ class Session(Slate):
 
     def expire(self):
         """Expires the session both client-side and slate-side"""
+        if self.mode is not None:
+            # Expiring requires updating the client's cookie
+            raise ReadOnlySlateError(
+                'Sessions cannot be expired in {0} mode'.format(self.mode))
         Slate.expire(self)
 
         one_year = 60 * 60 * 24 * 365
@@ -485,22 +1457,50 @@ class Session(Slate):
         """Returns the slate name for this session id"""
         return 'session-' + self.id
 
+    def _peek(self):
+        """Load the session for 'readonly' or 'notouch' mode"""
+        if self.mode not in ('readonly', 'notouch'):
+            raise ValueError('Unknown session mode: {0!r}'.format(self.mode))
+        self.readonly = self.mode == 'readonly'
+
+        storage = None
+        if self.id is not None:
+            name = self.get_slate_name()
+            cache = Slate.negative_cache
+            if cache is None or name not in cache:
+                storage = Slate.storage_class.peek(name, self.timeout)
+        else:
+            name = None
+        if storage is None:
+            log('Session {0} does not exist ({1})'.format(self.id, self.mode))
+            storage = _EmptyStorage(name)
+        Slate.__init__(self, name, timeout=self.timeout, storage=storage)
+
     def _test_id(self):
         """Test if we are expired.  If we are, assign a new id"""
         if self.id is None or self._is_expired():
             while True:
                 self.id = self._generate_id()
-                if self._is_expired():
+                if self._is_expired(negative_cache=False):
                     break
             log('Session {0} expired -> {1}'.format(self.originalid, self.id))
 
-    def _is_expired(self):
-        return Slate.is_expired(self.get_slate_name())
+    def _is_expired(self, negative_cache=True):
+        return Slate.is_expired(self.get_slate_name(), negative_cache)
         
     def _generate_id(self):
         """Return a new session id."""
         return binascii.hexlify(os.urandom(20)).decode('ascii')
     
+def flush_tracked():
+    """Write back modified tracked values for all slates used in this
+    request.  Bound to before_finalize by SlateTool.
+    """
+    session = getattr(cherrypy.serving, 'session', None)
+    if session is not None:
+        for slate in session.tracked_slates:
+            slate.flush()
+
 def init_session(
     session_path=None
     , session_path_header=None
@@ -529,6 +1529,8 @@ def init_session(
         to expire the cookie. If False, the cookie will not have an expiry,
         and the cookie will be a "session cookie" which expires when the
         browser is closed.
+    mode: None (the default), 'notouch' or 'readonly'.  See Session.mode.
+        In either mode, no response cookie is set.
     
     Any additional kwargs will be bound to the new Session instance,
     and may be specific to the storage type. See the subclass of Session
@@ -538,6 +1540,8 @@ def init_session(
     # Guard against running twice
     if hasattr(cherrypy.serving, "session"):
         return
+
+    mode = kwargs.pop('mode', None)
     
     request = cherrypy.serving.request
     name = session_cookie = kwargs.get('session_cookie', Session.session_cookie)
@@ -554,7 +1558,11 @@ def init_session(
     # Create and attach a new Session instance to cherrypy.serving.
     # It will possess a reference to (and lock, and lazily load)
     # the requested session data.
-    cherrypy.serving.session = sess = Session(id, **kwargs)
+    cherrypy.serving.session = sess = Session(id, mode=mode, **kwargs)
+
+    if mode is not None:
+        # Neither refresh nor replace the client's cookie
+        return
     
     if not session_persistent:
         # See http://support.microsoft.com/kb/223799/EN-US/
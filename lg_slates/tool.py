@@ -5,6 +5,8 @@ Usage: Put tools.lg_slates.on = True in the [global] section in your config file
 tools.lg_slates.storage_type may be specified to change the storage medium (defaults to RamStorage)
 """
 
+import threading
+
 import cherrypy
 from .common import *
 from . import slates
@@ -18,6 +20,9 @@ class SlateTool(cherrypy.Tool):
 
     storage_type = None
     storage_type__doc = """The CherryPy configuration for storage_type"""
+
+    setup_lock = threading.Lock()
+    setup_lock__doc = """Held while storage is set up, so that concurrent first requests wait for it"""
     
     def __init__(self):
         # slates.init must be bound after headers are read
@@ -44,20 +49,33 @@ class SlateTool(cherrypy.Tool):
         #to the session variable's presence)
         new_storage_type = conf.get('storage_type', 'ram')
         if self.storage_type != new_storage_type:
-            if not hasattr(cherrypy, 'session'):
-                cherrypy.session = cherrypy._ThreadLocalProxy('session')
-
-            #Find the storage class
-            self.storage_type = new_storage_type
-            self.storage_class = getattr(slates, self.storage_type.title() + 'Slate')
-
-            # Setup slates and slate storage
-            conf['storage_class'] = self.storage_class
-            slates.Slate.setup(**conf)
+            with self.setup_lock:
+                if self.storage_type != new_storage_type:
+                    self._setup_storage(new_storage_type, conf)
         
         p = conf.pop("priority", None)
         if p is None:
             p = getattr(self.callable, "priority", self._priority)
         
         hooks.attach(self._point, self.callable, priority=p, **conf)
+        # Persist modified change-tracking proxies, as CherryPy's own
+        # sessions save themselves
+        hooks.attach('before_finalize', slates.flush_tracked)
+
+    def _setup_storage(self, storage_type, conf):
+        """Must be called with self.setup_lock held"""
+        if not hasattr(cherrypy, 'session'):
+            cherrypy.session = cherrypy._ThreadLocalProxy('session')
+
+        #Find the storage class
+        self.storage_class = getattr(slates, storage_type.title() + 'Slate')
+
+        # Setup slates and slate storage
+        conf['storage_class'] = self.storage_class
+        slates.Slate.setup(**conf)
+
+        # Only now may other requests skip setup; until then they wait on
+        # setup_lock rather than using storage that isn't ready (e.g. an
+        # empty RAM store whose snapshot is still loading)
+        self.storage_type = storage_type
         
@@ -0,0 +1,190 @@
+"""Change-tracking proxies for mutable slate values.
+
+Slate.get(key, track=True) returns a TrackedDict or TrackedList in place of
+a dict or list value.  Any mutation of the proxy, or of a dict or list
+nested inside it, calls the proxy's on_change callback, which marks the key
+as dirty so that the slate can persist it at the end of the request.
+"""
+
+def track(value, on_change):
+    """Returns a tracking proxy (a copy) for value, or value itself if it
+    is not a dict or list.
+    """
+    if type(value) is dict:
+        return TrackedDict(value, on_change)
+    if type(value) is list:
+        return TrackedList(value, on_change)
+    return value
+
+def untrack(value):
+    """Returns value with all tracking proxies replaced by plain dicts and
+    lists, suitable for storage.  value itself is returned if it holds no
+    proxies.
+    """
+    if isinstance(value, dict):
+        items = [ (k, v, untrack(v)) for k, v in dict.items(value) ]
+        if type(value) is dict and all(u is v for _, v, u in items):
+            return value
+        return dict((k, u) for k, _, u in items)
+    if isinstance(value, list):
+        items = [ (v, untrack(v)) for v in list.__iter__(value) ]
+        if type(value) is list and all(u is v for v, u in items):
+            return value
+        return [ u for _, u in items ]
+    return value
+
+def _track_child(on_change, value):
+    if type(value) in (dict, list):
+        return track(value, on_change)
+    return value
+
+class TrackedDict(dict):
+    """A dict that calls on_change after every mutation"""
+
+    __slots__ = ('on_change',)
+
+    def __init__(self, value, on_change):
+        dict.__init__(self, value)
+        self.on_change = on_change
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        child = _track_child(self.on_change, value)
+        if child is not value:
+            # Replace with the proxy so that later mutations are seen
+            dict.__setitem__(self, key, child)
+        return child
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [ (k, self[k]) for k in self.keys() ]
+
+    def values(self):
+        return [ self[k] for k in self.keys() ]
+
+    def iteritems(self):
+        for k in self.keys():
+            yield k, self[k]
+
+    def itervalues(self):
+        for k in self.keys():
+            yield self[k]
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.on_change()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.on_change()
+
+    def clear(self):
+        dict.clear(self)
+        self.on_change()
+
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self.on_change()
+        return result
+
+    def popitem(self):
+        result = dict.popitem(self)
+        self.on_change()
+        return result
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.on_change()
+
+    def __reduce__(self):
+        # Never pickle the callback
+        return (dict, (untrack(self),))
+
+class TrackedList(list):
+    """A list that calls on_change after every mutation"""
+
+    __slots__ = ('on_change',)
+
+    def __init__(self, value, on_change):
+        list.__init__(self, value)
+        self.on_change = on_change
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            return value
+        child = _track_child(self.on_change, value)
+        if child is not value:
+            list.__setitem__(self, index, child)
+        return child
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self.on_change()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self.on_change()
+
+    def __setslice__(self, i, j, value): #PY2
+        list.__setslice__(self, i, j, value)
+        self.on_change()
+
+    def __delslice__(self, i, j): #PY2
+        list.__delslice__(self, i, j)
+        self.on_change()
+
+    def __iadd__(self, other):
+        list.__iadd__(self, other)
+        self.on_change()
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self.on_change()
+        return self
+
+    def append(self, value):
+        list.append(self, value)
+        self.on_change()
+
+    def extend(self, values):
+        list.extend(self, values)
+        self.on_change()
+
+    def insert(self, index, value):
+        list.insert(self, index, value)
+        self.on_change()
+
+    def pop(self, *args):
+        result = list.pop(self, *args)
+        self.on_change()
+        return result
+
+    def remove(self, value):
+        list.remove(self, value)
+        self.on_change()
+
+    def reverse(self):
+        list.reverse(self)
+        self.on_change()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self.on_change()
+
+    def __reduce__(self):
+        return (list, (untrack(self),))
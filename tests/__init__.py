@@ -3,7 +3,10 @@
 """
 
 import unittest
+from . import test_bloom
 from . import test_session
+from . import test_sharded
+from . import test_tracking
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,482 @@
+"""Concurrent end-to-end load generator for LameGame Productions' CherryPy
+Slates framework.
+
+Starts the slates tool in-process and drives it with a pool of simulated
+users.  Each user owns a cookie jar (so it keeps its session between
+requests) and performs a weighted mix of actions:
+
+    read    read back one of the user's session keys
+    write   write a new value to one of the user's session keys
+    named   read or write one of the user's keys in a shared named slate
+    new     drop the cookie jar, becoming a new visitor
+
+Several threads may share one user (--threads-per-user) to reproduce many
+concurrent requests against the same session; each thread writes its own
+keys so that a lost write is detectable.  Expectations are kept per
+session id, so a thread that briefly sees another of the user's sessions
+is not counted as a lost write.  Sessions the server replaces although
+the client presented them are reported separately as dropped: with the
+default --session-timeout, any dropped session was lost (lower it, and
+see --clean-freq, for expiry storms).  Concurrent first requests of a
+visitor, which each start a session, are reported as duplicates.
+
+Usage:
+
+    python -m tests.loadtest --backends ram,sharded,pymongo --users 50 --duration 30
+
+For each backend, reports throughput, p50/p99/p999 latency, storage
+operations per request (on the shards, for the sharded backend) and
+correctness violations.
+"""
+
+from __future__ import print_function
+
+import cookielib
+from optparse import OptionParser
+import random
+import sys
+import threading
+import time
+import urllib
+import urllib2
+
+import cherrypy
+import lg_slates
+from lg_slates import slates
+
+class LoadRoot(object):
+    """Handlers used by the simulated users.  Session responses are prefixed
+    with the session id so that clients can tell an expired session from a
+    lost write.
+    """
+
+    @cherrypy.expose
+    def read(self, key):
+        return '{0}:{1}'.format(cherrypy.session.id, cherrypy.session.get(key, 'null'))
+
+    @cherrypy.expose
+    def write(self, key, value):
+        cherrypy.session[key] = value
+        return '{0}:ok'.format(cherrypy.session.id)
+
+    @cherrypy.expose
+    def named(self, name, key, value=None):
+        s = lg_slates.Slate(name)
+        if value is None:
+            return s.get(key, 'null')
+        s[key] = value
+        return 'ok'
+
+class StorageCounter(object):
+    """Counts calls to the methods of one or more storage classes
+    (including their constructors, which is where sessions are touched).
+    """
+
+    methods = [ '__init__', 'set', 'get', 'pop', 'clear', 'keys', 'items'
+        , 'values', 'expire', 'update', 'setdefault', 'is_expired' ]
+
+    def __init__(self, storage_classes):
+        self.storage_classes = list(storage_classes)
+        self.lock = threading.Lock()
+        self.count = 0
+        self._originals = {}
+
+    def install(self):
+        for cls in self.storage_classes:
+            for name in self.methods:
+                for klass in cls.__mro__:
+                    if name in klass.__dict__:
+                        self._originals[cls, name] = (klass, klass.__dict__[name])
+                        break
+                else:
+                    continue
+                klass, attr = self._originals[cls, name]
+                if isinstance(attr, classmethod):
+                    setattr(cls, name, classmethod(self._wrap(attr.__func__)))
+                else:
+                    setattr(cls, name, self._wrap(attr))
+
+    def uninstall(self):
+        for (cls, name), (klass, attr) in self._originals.items():
+            if klass is cls:
+                setattr(cls, name, attr)
+            elif name in cls.__dict__:
+                # Inherited; remove our override
+                delattr(cls, name)
+
+    def _wrap(self, func):
+        counter = self
+        def wrapper(*args, **kwargs):
+            with counter.lock:
+                counter.count += 1
+            return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+class Stats(object):
+    """Thread-safe collection of request latencies and events"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.violations = 0
+        self.named_violations = 0
+        self.dropped_sessions = 0
+        self.duplicate_sessions = 0
+
+    def add(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def incr(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * p))
+        return ordered[index]
+
+class SimulatedUser(object):
+    """One visitor, possibly driven by several threads at once"""
+
+    session_cookie = 'session_id'
+
+    def __init__(self, base_url, stats, named_slates, named_prefix='load'):
+        self.base_url = base_url
+        self.stats = stats
+        self.named_slates = named_slates
+        self.named_prefix = named_prefix
+        # { (slate name, key): value } of acknowledged named slate writes.
+        # Named slates don't belong to a visitor, so these are kept by
+        # new_visitor().
+        self.named_expected = {}
+        self.lock = threading.Lock()
+        self.new_visitor()
+
+    def new_visitor(self):
+        opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+        # Requests still in flight for the old visitor check their
+        # responses against the old visitor's sessions
+        self.visitor = (opener, {})
+
+    def request(self, url, args):
+        """Returns (response, visitor), where visitor is the (sessions,
+        sent session id) of the visitor that sent the request; sessions is
+        its { session id: { key: value } } of acknowledged writes, and the
+        sent session id is the one in the request's cookie, or None.
+        Returns (None, None) on error.
+        """
+        opener, sessions = self.visitor
+        request = urllib2.Request(self.base_url + url, urllib.urlencode(args))
+        start = time.time()
+        try:
+            req = opener.open(request)
+            try:
+                result = req.read()
+            finally:
+                req.close()
+        except Exception:
+            self.stats.incr('errors')
+            return None, None
+        self.stats.add(time.time() - start)
+        return result, (sessions, self._sent_session_id(request))
+
+    def _sent_session_id(self, request):
+        """The session id that the cookie processor sent with request"""
+        for cookie in (request.get_header('Cookie') or '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == self.session_cookie:
+                return value
+        return None
+
+    def check_session(self, response, visitor):
+        """Splits a response into (remainder, expectations for the
+        response's session).  Must be called with self.lock held.
+        """
+        sessions, sent_id = visitor
+        session_id, _, value = response.partition(':')
+        if sent_id is not None and session_id != sent_id:
+            # The server didn't accept the session the client presented
+            self.stats.incr('dropped_sessions')
+        expected = sessions.get(session_id)
+        if expected is None:
+            if sent_id is None and sessions:
+                # Concurrent first requests each started a session
+                self.stats.incr('duplicate_sessions')
+            expected = sessions[session_id] = {}
+        return value, expected
+
+    def read(self, key):
+        response, visitor = self.request('/read', { 'key': key })
+        if response is None:
+            return
+        with self.lock:
+            value, expected = self.check_session(response, visitor)
+            # Only this thread writes key, so expected can't be stale
+            if value != expected.get(key, 'null'):
+                self.stats.incr('violations')
+
+    def write(self, key, value):
+        response, visitor = self.request('/write', { 'key': key, 'value': value })
+        if response is None:
+            return
+        with self.lock:
+            _, expected = self.check_session(response, visitor)
+            expected[key] = value
+
+    def named(self, thread_key, sequence):
+        name = '{0}-{1}'.format(
+            self.named_prefix, random.randrange(self.named_slates))
+        args = { 'name': name, 'key': thread_key }
+        write = random.random() < 0.5
+        if write:
+            args['value'] = str(sequence)
+        response, _ = self.request('/named', args)
+        if response is None:
+            return
+        with self.lock:
+            # As for session keys, only this thread writes thread_key
+            if write:
+                self.named_expected[name, thread_key] = args['value']
+            elif response != self.named_expected.get((name, thread_key), 'null'):
+                self.stats.incr('named_violations')
+
+def parse_mix(mix):
+    """'read=60,write=25' -> [('read', 60), ('write', 25)]"""
+    result = []
+    for part in mix.split(','):
+        action, weight = part.split('=')
+        result.append((action.strip(), int(weight)))
+    return result
+
+def choose(mix, total):
+    r = random.randrange(total)
+    for action, weight in mix:
+        if r < weight:
+            return action
+        r -= weight
+
+def drive(user, thread_index, mix, keys, deadline):
+    """Runs one thread of a simulated user until deadline"""
+    total = sum(w for _, w in mix)
+    sequence = 0
+    while time.time() < deadline:
+        sequence += 1
+        # Each thread owns its keys, so that lost writes are detectable
+        key = 'k{0}-{1}'.format(thread_index, random.randrange(keys))
+        action = choose(mix, total)
+        if action == 'read':
+            user.read(key)
+        elif action == 'write':
+            user.write(key, '{0}-{1}'.format(thread_index, sequence))
+        elif action == 'named':
+            user.named(key, sequence)
+        elif action == 'new':
+            user.new_visitor()
+
+def run_backend(backend, options):
+    """Starts the app on the given backend, runs the load, and returns a
+    dict of results.
+    """
+    conf = {
+        'tools.lg_slates.on': True
+        ,'tools.lg_slates.storage_type': backend
+        ,'tools.lg_slates.session_timeout': options.session_timeout
+        ,'tools.lg_slates.clean_freq': options.clean_freq
+        ,'server.socket_port': options.port
+        ,'server.thread_pool': options.server_threads
+        ,'log.screen': False
+        ,'engine.autoreload.on': False
+        }
+    if backend == 'pymongo':
+        conf['tools.lg_slates.storage_conf'] = {
+            'host': options.mongo_host
+            ,'port': None
+            ,'db': options.mongo_db
+            ,'collection': options.mongo_collection
+            }
+    elif backend == 'sharded':
+        conf['tools.lg_slates.storage_conf'] = {
+            'shards': dict(
+                ('shard{0}'.format(i), { 'storage_type': 'ram' })
+                for i in range(options.shards))
+            }
+    cherrypy.config.update(conf)
+    cherrypy.tree.mount(LoadRoot(), '/')
+    # Force storage setup for this backend
+    cherrypy.tools.lg_slates.storage_type = None
+    cherrypy.engine.start()
+
+    base_url = 'http://127.0.0.1:{0}'.format(options.port)
+    # Named slates outlive the run in persistent backends
+    named_prefix = 'load-{0:08x}'.format(random.getrandbits(32))
+    stats = Stats()
+    try:
+        # Warm-up request sets up the storage class, so it can be counted
+        warm = SimulatedUser(base_url, Stats(), options.named_slates)
+        warm.read('warmup')
+        storage_classes = [ slates.Slate.storage_class ]
+        if backend == 'sharded':
+            # The router only delegates; count what reaches the shards
+            storage_classes = slates.ShardedSlate.shards.values()
+        counter = StorageCounter(storage_classes)
+        counter.install()
+        try:
+            mix = parse_mix(options.mix)
+            threads = []
+            deadline = time.time() + options.duration
+            start = time.time()
+            for _ in range(options.users):
+                user = SimulatedUser(base_url, stats, options.named_slates
+                    , named_prefix)
+                for i in range(options.threads_per_user):
+                    t = threading.Thread(target=drive
+                        , args=(user, len(threads), mix, options.keys, deadline))
+                    t.daemon = True
+                    threads.append(t)
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.time() - start
+        finally:
+            counter.uninstall()
+    finally:
+        cherrypy.engine.stop()
+
+    requests = len(stats.latencies)
+    return {
+        'backend': backend
+        ,'requests': requests
+        ,'throughput': requests / elapsed
+        ,'p50': stats.percentile(0.5) * 1000
+        ,'p99': stats.percentile(0.99) * 1000
+        ,'p999': stats.percentile(0.999) * 1000
+        ,'ops_per_request': float(counter.count) / max(requests, 1)
+        ,'errors': stats.errors
+        ,'violations': stats.violations
+        ,'named_violations': stats.named_violations
+        ,'dropped_sessions': stats.dropped_sessions
+        ,'duplicate_sessions': stats.duplicate_sessions
+        }
+
+def ram_bytes_per_session(count, layout='slots'):
+    """Creates count sessions holding a user name and a visit counter, and
+    returns the average number of bytes held per session (as measured by
+    sys.getsizeof, counting shared objects once).  layout is one of:
+
+        dict    the { 'timestamp', 'timeout', 'data' } dicts RamSlate
+                stored before its records had __slots__ (baseline)
+        slots   RamSlate records
+        pickled RamSlate records with pickle_values
+    """
+    def request_key(key):
+        # Key names arrive as new strings with every request
+        return ''.join(list(key))
+
+    cls = slates.RamSlate
+    names = [ 'session-{0:040x}'.format(i) for i in range(count) ]
+    records = {}
+    old_pickle_values = cls.pickle_values
+    cls.pickle_values = (layout == 'pickled')
+    try:
+        for i, name in enumerate(names):
+            if layout == 'dict':
+                data = {}
+                records[name] = { 'timestamp': time.time(), 'timeout': 60
+                    , 'data': data }
+                data[request_key('auth')] = 'user-{0}'.format(i)
+                data[request_key('visits')] = i
+            else:
+                storage = cls(name, 60)
+                storage.set(request_key('auth'), 'user-{0}'.format(i))
+                storage.set(request_key('visits'), i)
+                records[name] = cls.cache.pop(name)
+    finally:
+        cls.pickle_values = old_pickle_values
+
+    seen = set()
+    def size(obj):
+        if obj is None or id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        total = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                total += size(k) + size(v)
+        elif isinstance(obj, cls):
+            for attr in cls.__slots__:
+                total += size(getattr(obj, attr))
+        return total
+
+    # Includes each session's entry in the cache
+    total = sys.getsizeof(records) + sum(
+        size(name) + size(record) for name, record in records.items())
+    return float(total) / count
+
+def main(args=None):
+    parser = OptionParser(usage='python -m tests.loadtest [options]')
+    parser.add_option('--backends', default='ram'
+        , help='Comma-separated storage types to test [%default]')
+    parser.add_option('--users', type='int', default=20
+        , help='Number of simulated users [%default]')
+    parser.add_option('--threads-per-user', type='int', default=2
+        , help='Concurrent threads sharing each user\'s session [%default]')
+    parser.add_option('--duration', type='float', default=10
+        , help='Seconds to run each backend [%default]')
+    parser.add_option('--mix', default='read=60,write=25,named=10,new=5'
+        , help='Weighted action mix [%default]')
+    parser.add_option('--keys', type='int', default=5
+        , help='Session keys per thread [%default]')
+    parser.add_option('--named-slates', type='int', default=10
+        , help='Number of shared named slates [%default]')
+    parser.add_option('--session-timeout', type='float', default=60
+        , help='Session timeout in minutes [%default]')
+    parser.add_option('--clean-freq', type='float', default=1
+        , help='Cleanup frequency in minutes [%default]')
+    parser.add_option('--port', type='int', default=8081
+        , help='Port to serve on [%default]')
+    parser.add_option('--server-threads', type='int', default=30
+        , help='CherryPy worker threads [%default]')
+    parser.add_option('--memory', type='int', default=0
+        , help='Instead of running load, report bytes per session for each '
+            'RamSlate layout over this many sessions')
+    parser.add_option('--shards', type='int', default=3
+        , help='Number of RAM shards for the sharded backend [%default]')
+    parser.add_option('--mongo-host', default=None)
+    parser.add_option('--mongo-db', default='test')
+    parser.add_option('--mongo-collection', default='slates_load')
+    options, _ = parser.parse_args(args)
+
+    if options.memory:
+        for layout in ('dict', 'slots', 'pickled'):
+            print('RamSlate {0:<8} {1:.0f} bytes/session'.format(
+                layout, ram_bytes_per_session(options.memory, layout)))
+        return
+
+    results = []
+    for backend in options.backends.split(','):
+        results.append(run_backend(backend.strip(), options))
+
+    # lost: session writes read back wrong; nlost: the same for named
+    # slates; dropped: sessions the server replaced although the client
+    # presented them; dup: extra sessions from concurrent first requests
+    print('{0:<10} {1:>8} {2:>9} {3:>8} {4:>8} {5:>8} {6:>7} {7:>6} {8:>6} {9:>6} {10:>7} {11:>6}'.format(
+        'backend', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms'
+        , 'ops/req', 'errors', 'lost', 'nlost', 'dropped', 'dup'))
+    for r in results:
+        print('{backend:<10} {requests:>8} {throughput:>9.1f} {p50:>8.2f} '
+            '{p99:>8.2f} {p999:>8.2f} {ops_per_request:>7.2f} {errors:>6} '
+            '{violations:>6} {named_violations:>6} {dropped_sessions:>7} '
+            '{duplicate_sessions:>6}'.format(**r))
+    cherrypy.engine.exit()
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import unittest
+
+from lg_slates.bloom import DecayingBloomFilter
+from lg_slates.slates import RamSlate, Session, Slate
+
+class DecayingBloomFilterTest(unittest.TestCase):
+    def test_add_contains(self):
+        f = DecayingBloomFilter(1000)
+        for i in range(400):
+            f.add('session-dead{0}'.format(i))
+        for i in range(400):
+            self.assertTrue('session-dead{0}'.format(i) in f)
+        self.assertEqual(f.stats()['hits'], 400)
+
+    def test_discard(self):
+        "A created name must never be reported as expired"
+        f = DecayingBloomFilter(1000)
+        f.add('session-a')
+        f.add('session-a')
+        f.discard('session-a')
+        self.assertFalse('session-a' in f)
+        self.assertEqual(f.invalidations, 1)
+
+    def test_error_rate(self):
+        f = DecayingBloomFilter(2000, error_rate=1e-3)
+        for i in range(1000):
+            f.add('session-dead{0}'.format(i))
+        false_positives = 0
+        for i in range(10000):
+            if 'session-live{0}'.format(i) in f:
+                false_positives += 1
+        self.assertTrue(false_positives < 30)
+
+    def test_decay(self):
+        f = DecayingBloomFilter(10)
+        f.add('session-old')
+        for i in range(10):
+            f.add('session-new{0}'.format(i))
+        self.assertFalse('session-old' in f)
+
+    def test_hit_rate(self):
+        f = DecayingBloomFilter(1000)
+        f.add('session-dead')
+        self.assertTrue('session-dead' in f)
+        self.assertFalse('session-live' in f)
+        self.assertEqual(f.hit_rate, 0.5)
+
+    def test_discard_absent(self):
+        "Discarding a name that was never added changes nothing"
+        f = DecayingBloomFilter(1000)
+        f.add('session-dead')
+        f.discard('session-new')
+        self.assertTrue('session-dead' in f)
+        self.assertEqual(f.invalidations, 0)
+
+    def test_add_after_discard(self):
+        "A name created while it was being looked up is not added"
+        f = DecayingBloomFilter(1000)
+        mark = f.discard_mark
+        f.discard('session-new')
+        f.add('session-new', mark)
+        self.assertFalse('session-new' in f)
+        f.add('session-new', f.discard_mark)
+        self.assertTrue('session-new' in f)
+
+class NegativeCacheTest(unittest.TestCase):
+    "Slate.is_expired and Session._test_id with the negative cache"
+    def setUp(self):
+        # Only set once the tool has set up storage
+        self.old_storage_class = getattr(Slate, 'storage_class', None)
+        Slate.storage_class = RamSlate
+        Slate.negative_cache = DecayingBloomFilter(1000)
+        RamSlate.cache.clear()
+
+    def tearDown(self):
+        if self.old_storage_class is None:
+            del Slate.storage_class
+        else:
+            Slate.storage_class = self.old_storage_class
+        Slate.negative_cache = None
+        RamSlate.cache.clear()
+
+    def test_is_expired(self):
+        cache = Slate.negative_cache
+        self.assertTrue(Slate.is_expired('user-dead'))
+        self.assertTrue(Slate.is_expired('user-dead'))
+        self.assertEqual(cache.hits, 1)
+        # Creating the slate invalidates the cached lookup
+        Slate('user-dead')
+        self.assertFalse(Slate.is_expired('user-dead'))
+
+    def test_created_during_lookup(self):
+        "A slate created between the storage lookup and add() stays live"
+        original = RamSlate.__dict__['is_expired']
+        def racing_is_expired(name):
+            result = original.__get__(None, RamSlate)(name)
+            Slate(name)
+            return result
+        RamSlate.is_expired = staticmethod(racing_is_expired)
+        try:
+            self.assertTrue(Slate.is_expired('user-racing'))
+        finally:
+            RamSlate.is_expired = original
+        self.assertFalse(Slate.is_expired('user-racing'))
+
+    def test_session_ids(self):
+        "Only client-supplied ids are remembered"
+        cache = Slate.negative_cache
+        Session(None)
+        self.assertEqual((cache.lookups, cache.adds), (0, 0))
+
+        s = Session('dead')
+        self.assertNotEqual(s.id, 'dead')
+        self.assertEqual(cache.adds, 1)
+        Session('dead')
+        self.assertEqual(cache.hits, 1)
+        self.assertFalse(Slate.is_expired(s.get_slate_name()))
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import time
 
@@ -27,6 +29,32 @@ class Root(object):
                 return 'Checking value after write - failed'
             return 'ok'
 
+        @cherrypy.expose
+        def put_ttl(self, key, data, ttl):
+            cherrypy.session.set(key, data, ttl=float(ttl))
+            return 'ok'
+
+        @cherrypy.expose
+        def append(self, key, data):
+            cherrypy.session.setdefault(key, [], track=True).append(data)
+            return 'ok'
+
+        @cherrypy.expose
+        def append_put(self, key, data):
+            "Appends to a tracked list, then writes it back explicitly"
+            cart = cherrypy.session.setdefault(key, [], track=True)
+            cart.append(data)
+            cherrypy.session[key] = cart
+            return type(cherrypy.session.storage.get(key, None)).__name__
+
+        @cherrypy.expose
+        def get_list(self, key):
+            return ','.join(cherrypy.session.get(key, []))
+
+        @cherrypy.expose
+        def keys(self):
+            return ','.join(sorted(cherrypy.session.keys()))
+
         @cherrypy.expose
         def expire(self):
             cherrypy.session.expire()
@@ -34,6 +62,23 @@ class Root(object):
 
     session = SessionTests()
 
+    class ReadOnlyTests(object):
+        _cp_config = { 'tools.lg_slates.mode': 'readonly' }
+
+        @cherrypy.expose
+        def get(self, key):
+            return cherrypy.session.get(key, 'null')
+
+        @cherrypy.expose
+        def put(self, key, data):
+            try:
+                cherrypy.session[key] = data
+            except lg_slates.ReadOnlySlateError:
+                return 'readonly'
+            return 'ok'
+
+    readonly = ReadOnlyTests()
+
 class SessionRamTest(unittest.TestCase):
     def setUp(self):
         r = Root()
@@ -72,11 +117,145 @@ class SessionRamTest(unittest.TestCase):
 
         self.assertNotEqual(make_request('/session/get_id'), sess_id)
 
+    def test_key_ttl(self):
+        # Start from an empty session
+        self.assertEqual(make_request('/session/expire'), 'ok')
+        self.assertEqual(make_request('/session/put', { 'key': 'test', 'data': '1234' }), 'ok')
+        self.assertEqual(make_request('/session/put_ttl', { 'key': 'token', 'data': 'abc', 'ttl': 0.01 }), 'ok')
+        self.assertEqual(make_request('/session/get', { 'key': 'token' }), 'abc')
+        self.assertEqual(make_request('/session/keys'), 'test,token')
+
+        # 0.6 seconds for key expire
+        time.sleep(1)
+
+        self.assertEqual(make_request('/session/get', { 'key': 'token' }), 'null')
+        self.assertEqual(make_request('/session/keys'), 'test')
+        self.assertEqual(make_request('/session/get', { 'key': 'test' }), '1234')
+
+    def test_tracked_append(self):
+        "In-place changes to tracked values persist at end of request"
+        self.assertEqual(make_request('/session/append', { 'key': 'cart', 'data': 'a' }), 'ok')
+        self.assertEqual(make_request('/session/append', { 'key': 'cart', 'data': 'b' }), 'ok')
+        self.assertEqual(make_request('/session/get_list', { 'key': 'cart' }), 'a,b')
+
+    def test_tracked_put(self):
+        "Writing a tracked value back stores a plain value"
+        self.assertEqual(make_request('/session/expire'), 'ok')
+        self.assertEqual(make_request('/session/append_put', { 'key': 'cart', 'data': 'a' }), 'list')
+        self.assertEqual(make_request('/session/append_put', { 'key': 'cart', 'data': 'b' }), 'list')
+        self.assertEqual(make_request('/session/get_list', { 'key': 'cart' }), 'a,b')
+
+    def test_readonly(self):
+        self.assertEqual(make_request('/session/put', { 'key': 'test', 'data': '1234' }), 'ok')
+        self.assertEqual(make_request('/readonly/get', { 'key': 'test' }), '1234')
+        self.assertEqual(make_request('/readonly/put', { 'key': 'test', 'data': '4321' }), 'readonly')
+        self.assertEqual(make_request('/session/get', { 'key': 'test' }), '1234')
+
+    def test_readonly_no_touch(self):
+        self.assertEqual(make_request('/session/put', { 'key': 'test', 'data': '1234' }), 'ok')
+
+        # Read-only requests must not keep the session alive (3 seconds)
+        for i in range(4):
+            time.sleep(1)
+            make_request('/readonly/get', { 'key': 'test' })
+
+        self.assertEqual(make_request('/readonly/get', { 'key': 'test' }), 'null')
+
     def test_auth_get(self):
         "Test auth caching"
         self.assertEqual(make_request('/session/put', { 'key': 'auth', 'data': 'user-ThisIsAUser' }), 'ok')
         self.assertEqual(make_request('/session/get', { 'key': 'auth' }), 'user-ThisIsAUser')
 
+class RamSlateTtlTest(unittest.TestCase):
+    def tearDown(self):
+        lg_slates.slates.RamSlate.cache.clear()
+
+    def test_clean_up_purges_keys(self):
+        RamSlate = lg_slates.slates.RamSlate
+        s = RamSlate('user-ttl', None)
+        # A rate limit window, re-set on every request
+        for i in range(100):
+            s.set('window', i, ttl=0.1 / 60)
+        s.set('kept', 1)
+        time.sleep(0.2)
+        RamSlate.clean_up()
+        self.assertEqual(s.data, { 'kept': 1 })
+        self.assertFalse(s.ttl)
+
+class SessionRamSnapshotTest(unittest.TestCase):
+    "Snapshots configured through storage_conf, across engine restarts"
+    def setUp(self):
+        fd, self.snapshot_file = tempfile.mkstemp()
+        os.close(fd)
+        cherrypy.config.update({
+          'tools.lg_slates.on': True
+          ,'tools.lg_slates.debug': True
+          ,'tools.lg_slates.session_timeout': 0.05
+          ,'tools.lg_slates.storage_type': 'ram'
+          ,'tools.lg_slates.storage_conf': {
+            'snapshot_file': self.snapshot_file
+            ,'snapshot_freq': 0.01 #Snapshot every 0.6 seconds
+            }
+          })
+        # Force storage setup with the new storage_conf
+        cherrypy.tools.lg_slates.storage_type = None
+        cherrypy.tree.mount(Root(), '/')
+        cherrypy.engine.start()
+
+    def tearDown(self):
+        cherrypy.engine.stop()
+        cherrypy.config.update({ 'tools.lg_slates.storage_conf': {} })
+        cherrypy.tools.lg_slates.storage_type = None
+        lg_slates.slates.RamSlate.snapshot_file = None
+        for path in (self.snapshot_file, self.snapshot_file + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def restart(self):
+        "Restarts the engine with an empty RAM store"
+        cherrypy.engine.stop()
+        lg_slates.slates.RamSlate.cache.clear()
+        cherrypy.engine.start()
+
+    def test_snapshot_restart(self):
+        self.assertEqual(make_request('/session/put', { 'key': 'test', 'data': '1234' }), 'ok')
+
+        # Written periodically by the snapshot thread
+        time.sleep(1)
+        self.assertTrue(os.path.getsize(self.snapshot_file) > 0)
+
+        # Written on stop, loaded on start
+        self.assertEqual(make_request('/session/put', { 'key': 'test2', 'data': '4321' }), 'ok')
+        self.restart()
+        self.assertEqual(make_request('/session/get', { 'key': 'test' }), '1234')
+        self.assertEqual(make_request('/session/get', { 'key': 'test2' }), '4321')
+
+    def test_snapshot_skips_expired(self):
+        self.assertEqual(make_request('/session/put', { 'key': 'test', 'data': '1234' }), 'ok')
+        cherrypy.engine.stop()
+        lg_slates.slates.RamSlate.cache.clear()
+
+        # 3 seconds for session expire
+        time.sleep(3.5)
+
+        cherrypy.engine.start()
+        self.assertEqual(len(lg_slates.slates.RamSlate.cache), 0)
+
+class SessionShardedTest(SessionRamTest):
+    def setUp(self):
+        cherrypy.config.update({
+          'tools.lg_slates.storage_type': 'sharded'
+          ,'tools.lg_slates.storage_conf': {
+            'shards': {
+              'a': { 'storage_type': 'ram' }
+              ,'b': { 'storage_type': 'ram' }
+              ,'c': { 'storage_type': 'ram' }
+              }
+            }
+          })
+
+        SessionRamTest.setUp(self)
+
 class SessionMongoDbTest(SessionRamTest):
     def setUp(self):
         cherrypy.config.update({
@@ -91,3 +270,23 @@ class SessionMongoDbTest(SessionRamTest):
 
         SessionRamTest.setUp(self)
 
+
+class SessionMongoDbOffloadTest(SessionMongoDbTest):
+    "Stores every value out of line"
+    def setUp(self):
+        SessionMongoDbTest.setUp(self)
+        cherrypy.config.update({
+          'tools.lg_slates.storage_conf': {
+            'host': None
+            ,'port': None
+            ,'db': 'test'
+            ,'collection': 'slates'
+            ,'offload_size': 8
+            }
+          })
+        # Force storage setup with the new storage_conf
+        cherrypy.tools.lg_slates.storage_type = None
+
+    def tearDown(self):
+        SessionMongoDbTest.tearDown(self)
+        cherrypy.tools.lg_slates.storage_type = None
@@ -0,0 +1,78 @@
+import unittest
+
+from lg_slates.hashring import ConsistentHashRing
+from lg_slates.slates import ShardedSlate
+
+def ram_shards(*names):
+    return dict((n, { 'storage_type': 'ram' }) for n in names)
+
+class ConsistentHashRingTest(unittest.TestCase):
+    def test_stable(self):
+        ring = ConsistentHashRing({ 'a': 1, 'b': 2, 'c': 3 })
+        other = ConsistentHashRing({ 'c': 3, 'b': 2, 'a': 1 })
+        for i in range(100):
+            key = 'session-{0}'.format(i)
+            self.assertEqual(ring.get(key), other.get(key))
+
+    def test_minimal_movement(self):
+        "Adding a node only moves keys onto that node"
+        ring = ConsistentHashRing({ 'a': 1, 'b': 2, 'c': 3 })
+        bigger = ConsistentHashRing({ 'a': 1, 'b': 2, 'c': 3, 'd': 4 })
+        moved = 0
+        for i in range(1000):
+            key = 'session-{0}'.format(i)
+            if ring.get(key) != bigger.get(key):
+                self.assertEqual(bigger.get(key), 4)
+                moved += 1
+        self.assertTrue(100 < moved < 400)
+
+class ShardedSlateTest(unittest.TestCase):
+    def setUp(self):
+        ShardedSlate.shards = {}
+        ShardedSlate.shard_confs = {}
+        ShardedSlate.setup({ 'shards': ram_shards('a', 'b', 'c') })
+
+    def test_routing(self):
+        for i in range(50):
+            s = ShardedSlate('user-{0}'.format(i), None)
+            s.set('value', i)
+        total = 0
+        for shard in ShardedSlate.shards.values():
+            total += len(shard.cache)
+            self.assertTrue(len(shard.cache) > 0)
+        self.assertEqual(total, 50)
+        self.assertEqual(ShardedSlate('user-7', None).get('value', None), 7)
+
+    def test_is_expired_clean_up(self):
+        ShardedSlate('user-1', None)
+        self.assertFalse(ShardedSlate.is_expired('user-1'))
+        self.assertTrue(ShardedSlate.is_expired('user-2'))
+        ShardedSlate('user-3', 0)
+        ShardedSlate.clean_up()
+        self.assertTrue(ShardedSlate.is_expired('user-3'))
+
+    def test_rebalance(self):
+        names = [ 'user-{0}'.format(i) for i in range(50) ]
+        for i, name in enumerate(names):
+            s = ShardedSlate(name, None)
+            s.set('value', i)
+            s.set('token', i, ttl=10)
+        old_shards = dict(ShardedSlate.shards)
+
+        ShardedSlate.setup({
+            'shards': ram_shards('a', 'b', 'c', 'd')
+            ,'previous_ring': [ 'a', 'b', 'c' ]
+            })
+        for name in ('a', 'b', 'c'):
+            self.assertTrue(ShardedSlate.shards[name] is old_shards[name])
+
+        for i, name in enumerate(names):
+            self.assertFalse(ShardedSlate.is_expired(name))
+            s = ShardedSlate(name, None)
+            self.assertEqual(s.get('value', None), i)
+            self.assertEqual(s.get('token', None), i)
+            self.assertTrue(0 < s.key_ttls()['token'] <= 10)
+        moved = len(ShardedSlate.shards['d'].cache)
+        self.assertTrue(moved > 0)
+        self.assertEqual(
+            sum(len(s.cache) for s in old_shards.values()), 50 - moved)
@@ -0,0 +1,97 @@
+import pickle
+import time
+import unittest
+
+from lg_slates.slates import RamSlate, Slate
+from lg_slates.tracking import track, untrack, TrackedDict, TrackedList
+
+class TrackingTest(unittest.TestCase):
+    def setUp(self):
+        self.changes = 0
+
+    def on_change(self):
+        self.changes += 1
+
+    def test_untrackable(self):
+        self.assertEqual(track('abc', self.on_change), 'abc')
+
+    def test_dict(self):
+        d = track({ 'a': 1 }, self.on_change)
+        self.assertTrue(isinstance(d, TrackedDict))
+        self.assertEqual(d['a'], 1)
+        self.assertEqual(self.changes, 0)
+        d['b'] = 2
+        d.update(c=3)
+        d.pop('a')
+        self.assertEqual(self.changes, 3)
+        self.assertEqual(untrack(d), { 'b': 2, 'c': 3 })
+
+    def test_list(self):
+        l = track([ 1 ], self.on_change)
+        self.assertTrue(isinstance(l, TrackedList))
+        l.append(2)
+        l += [ 3 ]
+        l[0] = 0
+        l.sort(reverse=True)
+        self.assertEqual(self.changes, 4)
+        self.assertEqual(untrack(l), [ 3, 2, 0 ])
+
+    def test_nested(self):
+        value = { 'cart': [ { 'qty': 1 } ] }
+        d = track(value, self.on_change)
+        d['cart'][0]['qty'] += 1
+        d.get('cart').append({ 'qty': 5 })
+        for item in d['cart']:
+            item['seen'] = True
+        self.assertEqual(self.changes, 4)
+        self.assertEqual(untrack(d), {
+            'cart': [ { 'qty': 2, 'seen': True }, { 'qty': 5, 'seen': True } ] })
+        # The original value is not modified
+        self.assertEqual(value, { 'cart': [ { 'qty': 1 } ] })
+
+    def test_untrack_nested_proxy(self):
+        cart = track([ 'a' ], self.on_change)
+        value = { 'cart': cart }
+        result = untrack(value)
+        self.assertEqual(type(result['cart']), list)
+        self.assertEqual(result, { 'cart': [ 'a' ] })
+        # Values without proxies are returned as-is
+        plain = { 'cart': [ 'a' ] }
+        self.assertTrue(untrack(plain) is plain)
+
+    def test_pickle(self):
+        d = track({ 'a': [ 1 ] }, self.on_change)
+        loaded = pickle.loads(pickle.dumps(d))
+        self.assertEqual(type(loaded), dict)
+        self.assertEqual(loaded, { 'a': [ 1 ] })
+
+class SlateFlushTest(unittest.TestCase):
+    def setUp(self):
+        # Only set once the tool has set up storage
+        self.old_storage_class = getattr(Slate, 'storage_class', None)
+        Slate.storage_class = RamSlate
+
+    def tearDown(self):
+        if self.old_storage_class is None:
+            del Slate.storage_class
+        else:
+            Slate.storage_class = self.old_storage_class
+        RamSlate.cache.clear()
+
+    def test_flush_keeps_ttl(self):
+        s = Slate('user-window')
+        s.set('window', [ 1 ], ttl=1)
+        s.get('window', track=True).append(2)
+        s.flush()
+        self.assertEqual(s.get('window'), [ 1, 2 ])
+        self.assertTrue(0 < s.storage.key_ttls()['window'] <= 1)
+
+    def test_flush_expired(self):
+        "A tracked key whose ttl runs out before the flush stays expired"
+        s = Slate('user-window')
+        s.set('window', [ 1 ], ttl=0.3 / 60)
+        s.get('window', track=True).append(2)
+        time.sleep(0.4)
+        s.flush()
+        self.assertEqual(s.get('window'), None)
+        self.assertEqual(s.storage.key_ttls(), {})